@@ -8,6 +8,7 @@ from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .api import PhilipsAirPlusAPI
+from .hub import PhilipsMQTTHub
 from .const import (
     DOMAIN, CONF_ACCESS_TOKEN, CONF_REFRESH_TOKEN, CONF_ID_TOKEN,
     CONF_EXPIRES_AT, CONF_USER_ID
@@ -31,6 +32,15 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
             CONF_ID_TOKEN: tokens.get("id_token"),
             CONF_EXPIRES_AT: tokens.get("expires_at"),
         })
+        # Every update rewrites the config entries store, skip no-op updates
+        unchanged = all(
+            entry.data.get(key) == new_data[key]
+            for key in (CONF_ACCESS_TOKEN, CONF_REFRESH_TOKEN, CONF_ID_TOKEN)
+        )
+        old_expires_at = entry.data.get(CONF_EXPIRES_AT) or 0
+        new_expires_at = new_data[CONF_EXPIRES_AT] or 0
+        if unchanged and abs(new_expires_at - old_expires_at) <= 60:
+            return
         hass.config_entries.async_update_entry(entry, data=new_data)
         _LOGGER.debug("Philips Air+ tokens updated and persisted")
 
@@ -42,16 +52,27 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     api.expires_at = entry.data.get(CONF_EXPIRES_AT)
     api.user_id = entry.data.get(CONF_USER_ID)
 
-    hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN][entry.entry_id] = api
+    # Each entry holds one device; entries of the same account share a
+    # single MQTT connection
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    hubs = domain_data.setdefault("hubs", {})
+    hub = hubs.get(api.user_id)
+    if hub is None:
+        hub = hubs[api.user_id] = PhilipsMQTTHub(hass)
+    hub.async_add_entry(entry.entry_id, api)
+    domain_data[entry.entry_id] = hub
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    hub.async_start()
 
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
-        hass.data[DOMAIN].pop(entry.entry_id)
+        hub = hass.data[DOMAIN].pop(entry.entry_id)
+        if hub.async_remove_entry(entry.entry_id):
+            del hass.data[DOMAIN]["hubs"][entry.data.get(CONF_USER_ID)]
+            await hub.async_stop()
 
     return unload_ok
@@ -1,47 +1,109 @@
 import asyncio
-import base64
-import hashlib
-import json
 import logging
-import os
-import secrets
+import random
 import time
 from typing import Any, Callable, Dict, List, Optional
-from urllib.parse import urlparse, parse_qs
 
 import aiohttp
+
 from .const import (
-    API_BASE, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SCOPE, 
-    TOKEN_URL, USER_AGENT, WS_URL
+    API_BASE, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI,
+    TOKEN_URL, USER_AGENT, SIGNATURE_CACHE_TTL
 )
+from .util import json_dumps, json_loads
 
 _LOGGER = logging.getLogger(__name__)
 
-def base64_url_encode(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).decode('utf-8').replace('=', '')
+# Token refresh retry policy
+REFRESH_ATTEMPTS = 4
+REFRESH_FAILURE_HOLDOFF = 30
+
+# Cap on how much of an error response body is read for logging
+ERROR_BODY_LIMIT = 4096
+
+async def _read_error(resp: aiohttp.ClientResponse) -> str:
+    """Read at most ERROR_BODY_LIMIT bytes of an error response body."""
+    return (await resp.content.read(ERROR_BODY_LIMIT)).decode('utf-8', 'replace')
 
 class PhilipsAirPlusAPI:
     def __init__(self, session: aiohttp.ClientSession, on_token_update: Optional[Callable[[Dict[str, Any]], None]] = None):
         self.session = session
+        self._auth_headers = {"User-Agent": USER_AGENT, "Authorization": ""}
+        self._json_headers = {"User-Agent": USER_AGENT, "Content-Type": "application/json"}
         self.access_token = None
         self.refresh_token = None
         self.id_token = None
         self.expires_at = 0
         self.user_id = None
         self._on_token_update = on_token_update
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_refresh_failure: Optional[float] = None
+        # Monotonic deadline until which the access token needs no expiry check
+        self._known_valid_until = 0.0
+        # (value, expires_at) pairs for slow-changing responses
+        self._sig_cache: tuple[Optional[str], float] = (None, 0)
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._access_token
+
+    @access_token.setter
+    def access_token(self, value: Optional[str]) -> None:
+        # Keep the shared Authorization header in sync with the token
+        self._access_token = value
+        self._auth_headers["Authorization"] = f"Bearer {value}"
+
+    @property
+    def authorization(self) -> str:
+        """Return the pre-formatted bearer value for the current access token."""
+        return self._auth_headers["Authorization"]
 
     @staticmethod
     def generate_pkce() -> tuple[str, str]:
-        verifier = base64_url_encode(secrets.token_bytes(32))
-        challenge = base64_url_encode(hashlib.sha256(verifier.encode('utf-8')).digest())
+        # Only needed during the config flow, so import lazily
+        import base64
+        import hashlib
+        import secrets
+
+        # token_urlsafe already yields unpadded base64url (43 chars for 32 bytes)
+        verifier = secrets.token_urlsafe(32)
+        challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode('ascii')).digest()).rstrip(b'=').decode('ascii')
         return verifier, challenge
 
+    @classmethod
+    async def async_generate_pkce(cls, hass) -> tuple[str, str]:
+        """Generate a PKCE pair in the executor to keep hashing off the event loop."""
+        return await hass.async_add_executor_job(cls.generate_pkce)
+
     async def ensure_valid_token(self):
         """Ensure the access token is valid, refreshing if necessary."""
-        # Refresh if token is expired or expiring within 5 minutes to be safe
-        if time.time() >= self.expires_at - 300:
-            _LOGGER.debug("Token expired or expiring soon, refreshing...")
-            await self.refresh_tokens()
+        # Refresh if token is expired or expiring within 5 minutes to be safe.
+        # Concurrent callers share a single in-flight refresh instead of each
+        # posting to the token endpoint (refresh tokens may be rotated).
+        # Fast path: the token was already checked and is known to be valid
+        if time.monotonic() < self._known_valid_until:
+            return
+        async with self._refresh_lock:
+            remaining = self.expires_at - 300 - time.time()
+            if remaining > 0:
+                self._known_valid_until = time.monotonic() + remaining
+                return
+            if (
+                self._last_refresh_failure is not None
+                and time.monotonic() - self._last_refresh_failure < REFRESH_FAILURE_HOLDOFF
+            ):
+                raise Exception("Refresh error: token refresh failed recently, not retrying yet")
+            if self._refresh_task is None or self._refresh_task.done():
+                _LOGGER.debug("Token expired or expiring soon, refreshing...")
+                self._refresh_task = asyncio.create_task(self.refresh_tokens())
+            task = self._refresh_task
+        try:
+            # A caller being cancelled must not cancel the refresh others share
+            await asyncio.shield(task)
+        finally:
+            if self._refresh_task is task and task.done():
+                self._refresh_task = None
 
     async def get_tokens_from_code(self, code: str, verifier: str) -> Dict[str, Any]:
         data = {
@@ -54,10 +116,10 @@ class PhilipsAirPlusAPI:
         }
         async with self.session.post(TOKEN_URL, data=data) as resp:
             if resp.status != 200:
-                text = await resp.text()
+                text = await _read_error(resp)
                 _LOGGER.error("Failed to get tokens: %s", text)
                 raise Exception(f"Token error: {resp.status} - {text}")
-            tokens = await resp.json()
+            tokens = await resp.json(loads=json_loads)
             tokens["expires_at"] = time.time() + tokens.get("expires_in", 3600)
             self._update_tokens(tokens)
             return tokens
@@ -69,53 +131,77 @@ class PhilipsAirPlusAPI:
             "grant_type": "refresh_token",
             "refresh_token": self.refresh_token,
         }
-        async with self.session.post(TOKEN_URL, data=data) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                _LOGGER.error("Failed to refresh tokens: %s", text)
-                raise Exception(f"Refresh error: {resp.status} - {text}")
-            tokens = await resp.json()
-            tokens["expires_at"] = time.time() + tokens.get("expires_in", 3600)
-            self._update_tokens(tokens)
-            return tokens
+        error: Optional[Exception] = None
+        for attempt in range(REFRESH_ATTEMPTS):
+            if attempt:
+                # Capped exponential backoff with jitter between attempts
+                await asyncio.sleep(min(2 ** attempt, 30) + random.random())
+            try:
+                async with self.session.post(TOKEN_URL, data=data) as resp:
+                    if resp.status == 200:
+                        tokens = await resp.json(loads=json_loads)
+                        tokens["expires_at"] = time.time() + tokens.get("expires_in", 3600)
+                        self._update_tokens(tokens)
+                        self._last_refresh_failure = None
+                        return tokens
+                    text = await _read_error(resp)
+                    _LOGGER.error("Failed to refresh tokens: %s", text)
+                    error = Exception(f"Refresh error: {resp.status} - {text}")
+                    if resp.status < 500:
+                        # A rejected (e.g. revoked or rotated) grant won't succeed on retry
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                _LOGGER.warning("Error refreshing tokens: %s", err)
+                error = err
+        self._last_refresh_failure = time.monotonic()
+        raise error
 
     def _update_tokens(self, tokens: Dict[str, Any]):
         self.access_token = tokens.get("access_token")
-        self.refresh_token = tokens.get("refresh_token")
-        self.id_token = tokens.get("id_token")
+        # The IdP may omit unrotated tokens, keep the ones we already have
+        self.refresh_token = tokens.get("refresh_token") or self.refresh_token
+        self.id_token = tokens.get("id_token") or self.id_token
         self.expires_at = tokens.get("expires_at")
+        self._known_valid_until = 0.0
+        tokens["refresh_token"] = self.refresh_token
+        tokens["id_token"] = self.id_token
+        # The signature is presented alongside the access token, fetch a new one
+        self._sig_cache = (None, 0)
         if self._on_token_update:
             self._on_token_update(tokens)
 
     async def get_user_id(self) -> str:
         await self.ensure_valid_token()
-        headers = {"User-Agent": USER_AGENT, "Content-Type": "application/json"}
         payload = {"idToken": self.id_token}
-        async with self.session.post(f"{API_BASE}/user/self/get-id", headers=headers, json=payload) as resp:
-            data = await resp.json()
+        async with self.session.post(f"{API_BASE}/user/self/get-id", headers=self._json_headers, data=json_dumps(payload)) as resp:
+            data = await resp.json(loads=json_loads)
             self.user_id = data.get("userId")
             return self.user_id
 
     async def get_devices(self) -> List[Dict[str, Any]]:
         await self.ensure_valid_token()
-        headers = {
-            "User-Agent": USER_AGENT,
-            "Authorization": f"Bearer {self.access_token}"
-        }
-        async with self.session.get(f"{API_BASE}/user/self/device", headers=headers) as resp:
-            return await resp.json()
+        async with self.session.get(f"{API_BASE}/user/self/device", headers=self._auth_headers) as resp:
+            return await resp.json(loads=json_loads)
 
     async def get_signature(self) -> str:
-        # Crucial: Always ensure token is valid before fetching signature
+        # Crucial: Always ensure token is valid before fetching signature,
+        # a refresh also drops the cached one
         await self.ensure_valid_token()
-        headers = {
-            "User-Agent": USER_AGENT,
-            "Authorization": f"Bearer {self.access_token}"
-        }
-        async with self.session.get(f"{API_BASE}/user/self/signature", headers=headers) as resp:
+        signature, expires_at = self._sig_cache
+        if signature is not None and time.time() < expires_at:
+            return signature
+        async with self.session.get(f"{API_BASE}/user/self/signature", headers=self._auth_headers) as resp:
             if resp.status != 200:
-                text = await resp.text()
+                text = await _read_error(resp)
                 _LOGGER.error("Failed to get signature: %s", text)
                 raise Exception(f"Signature error: {resp.status}")
-            data = await resp.json()
-            return data.get("signature")
+            data = await resp.json(loads=json_loads)
+            signature = data.get("signature")
+            # Never keep it past the point the token will be refreshed
+            expires_at = min(time.time() + SIGNATURE_CACHE_TTL, self.expires_at - 300)
+            self._sig_cache = (signature, expires_at)
+            return signature
+
+    def invalidate_signature(self) -> None:
+        """Drop the cached signature, e.g. after the broker rejected it."""
+        self._sig_cache = (None, 0)
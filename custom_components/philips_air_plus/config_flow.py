@@ -1,9 +1,9 @@
 """Config flow for Philips Air+ integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
 from typing import Any
-from urllib.parse import urlparse, parse_qs, urlencode
 
 import voluptuous as vol
 from homeassistant import config_entries
@@ -28,39 +28,44 @@ class PhilipsAirPlusConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         """Initialize the config flow."""
         self._verifier: str | None = None
         self._challenge: str | None = None
+        self._auth_link: str | None = None
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> ConfigFlowResult:
         """Handle the initial step."""
-        # Ensure PKCE values are generated once and stored in the flow instance
+        # Ensure PKCE values and the auth link are generated once and stored in the flow instance
         if self._verifier is None:
-            self._verifier, self._challenge = PhilipsAirPlusAPI.generate_pkce()
+            from urllib.parse import quote, urlencode
 
-        auth_params = {
-            "client_id": CLIENT_ID,
-            "code_challenge": self._challenge,
-            "code_challenge_method": "S256",
-            "response_type": "code",
-            "redirect_uri": REDIRECT_URI,
-            "ui_locales": "en-US",
-            "scope": SCOPE,
-        }
-        # Use urlencode to properly escape parameters
-        query_string = urlencode(auth_params)
-        auth_link = f"{AUTH_URL}?{query_string}"
+            self._verifier, self._challenge = await PhilipsAirPlusAPI.async_generate_pkce(self.hass)
+
+            auth_params = {
+                "client_id": CLIENT_ID,
+                "code_challenge": self._challenge,
+                "code_challenge_method": "S256",
+                "response_type": "code",
+                "redirect_uri": REDIRECT_URI,
+                "ui_locales": "en-US",
+                "scope": SCOPE,
+            }
+            # Use urlencode to properly escape parameters (spaces in SCOPE as %20)
+            query_string = urlencode(auth_params, quote_via=quote)
+            self._auth_link = f"{AUTH_URL}?{query_string}"
 
         errors = {}
         if user_input is not None:
+            from urllib.parse import parse_qs, urlparse
+
             redirect_url = user_input.get(CONF_REDIRECT_URL)
             try:
-                # Robust code extraction
-                code = None
-                if "code=" in redirect_url:
-                    # Split by code= and then by the next & or end of string
-                    parts = redirect_url.split("code=")
-                    if len(parts) > 1:
-                        code = parts[1].split("&")[0]
+                # Robust code extraction: parse the query, fall back to a plain
+                # split for URLs the parser does not handle (e.g. code in a fragment)
+                query = urlparse(redirect_url, allow_fragments=False).query
+                code = parse_qs(query).get("code", [None])[0] or (
+                    redirect_url.split("code=", 1)[1].split("&", 1)[0]
+                    if "code=" in redirect_url else None
+                )
                 
                 if code:
                     _LOGGER.debug("Extracted code, attempting token exchange with verifier: %s", self._verifier)
@@ -69,13 +74,23 @@ class PhilipsAirPlusConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     
                     # This call now includes the fixed expires_at calculation
                     tokens = await api.get_tokens_from_code(code, self._verifier)
-                    user_id = await api.get_user_id()
-                    devices = await api.get_devices()
+                    user_id, devices = await asyncio.gather(
+                        api.get_user_id(), api.get_devices()
+                    )
                     
+                    # One entry per device, offer the first that isn't set up yet
+                    configured = {
+                        entry.data.get(CONF_THING_NAME)
+                        for entry in self._async_current_entries()
+                    }
+                    device = next(
+                        (d for d in devices if d["thingName"] not in configured), None
+                    )
                     if not devices:
                         errors["base"] = "no_devices"
+                    elif device is None:
+                        return self.async_abort(reason="already_configured")
                     else:
-                        device = devices[0]
                         return self.async_create_entry(
                             title=device.get("friendlyName", "Philips Air Purifier"),
                             data={
@@ -99,6 +114,6 @@ class PhilipsAirPlusConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             data_schema=vol.Schema({
                 vol.Required(CONF_REDIRECT_URL): str,
             }),
-            description_placeholders={"auth_url": auth_link},
+            description_placeholders={"auth_url": self._auth_link},
             errors=errors,
         )
@@ -1,4 +1,5 @@
 """Constants for the Philips Air+ integration."""
+from types import MappingProxyType
 
 DOMAIN = "philips_air_plus"
 
@@ -14,8 +15,10 @@ CONF_SIGNATURE = "signature"
 # OAuth2 Secret Obfuscation
 # def make_mj(s, key=0x55):
 #     return [ord(c) ^ key for c in s]
+_XOR55 = bytes([i ^ 0x55 for i in range(256)])
+
 def _mj(data):
-    return "".join(chr(x ^ 0x55) for x in data)
+    return bytes(data).translate(_XOR55).decode("ascii")
 
 _CID_mj = [120, 13, 38, 30, 98, 26, 99, 60, 16, 62, 25, 56, 57, 98, 98, 44, 17, 18, 17, 0, 60, 101, 62, 32]
 _CSC_mj = [3, 102, 97, 23, 57, 20, 61, 32, 60, 57, 28, 49, 26, 45, 101, 28, 56, 58, 100, 99, 39, 18, 4, 103]
@@ -30,8 +33,16 @@ TOKEN_URL = "https://cdc.accounts.home.id/oidc/op/v1.0/4_JGZWlP8eQHpEqkvQElolbA/
 API_BASE = "https://prod.eu-da.iot.versuni.com/api/da"
 USER_AGENT = "Air (com.philips.ph.homecare; build:3.16.1; locale:en_US; Android:12 Sdk:2.2.0) okhttp/4.12.0"
 
+# Response cache lifetimes (seconds)
+SIGNATURE_CACHE_TTL = 3300
+
 # MQTT Configuration
 WS_URL = "wss://ats.prod.eu-da.iot.versuni.com/mqtt"
+MQTT_HOST = "ats.prod.eu-da.iot.versuni.com"
+MQTT_PORT = 443
+MQTT_KEEPALIVE = 30
+# Seconds to wait for the CONNACK after the socket is up
+MQTT_CONNECT_TIMEOUT = 20
 
 # Modes mapping
 # 0: Auto, 1: Medium, 17: Low, 18: High
@@ -41,10 +52,10 @@ MODE_LOW = 17
 MODE_HIGH = 18
 
 PRESET_MODES = ["Auto", "Low", "Medium", "High"]
-MODE_TO_VALUE = {
+MODE_TO_VALUE = MappingProxyType({
     "Auto": MODE_AUTO,
     "Low": MODE_LOW,
     "Medium": MODE_MEDIUM,
     "High": MODE_HIGH,
-}
-VALUE_TO_MODE = {v: k for k, v in MODE_TO_VALUE.items()}
+})
+VALUE_TO_MODE = MappingProxyType({v: k for k, v in MODE_TO_VALUE.items()})
@@ -0,0 +1,305 @@
+"""Shared MQTT connection for the Philips Air+ integration."""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import threading
+from typing import Callable
+
+import paho.mqtt.client as mqtt
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.util.ssl import client_context
+
+from .api import PhilipsAirPlusAPI
+from .const import MQTT_CONNECT_TIMEOUT, MQTT_HOST, MQTT_KEEPALIVE, MQTT_PORT
+
+_LOGGER = logging.getLogger(__name__)
+
+class PhilipsMQTTHub:
+    """One MQTT connection per account, shared by the entities of all its config entries."""
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        # Config entry id -> API of that entry, any of them can authenticate
+        self._apis: dict[str, PhilipsAirPlusAPI] = {}
+
+        self._mqtt_client: mqtt.Client | None = None
+        # Shadow "accepted" topic -> handler of the entity for that thing
+        self._subscribers: dict[str, Callable[[bytes], None]] = {}
+        self._reconnect_task: asyncio.Task | None = None
+        self._connect_future: asyncio.Future | None = None
+        self._should_reconnect = True
+
+        # Set from paho's connect/disconnect callbacks
+        self._connected_evt = asyncio.Event()
+        self._disconnected_evt = asyncio.Event()
+        self._loop = hass.loop
+        self._retry_cap = 5
+
+        # paho's socket is driven by the event loop instead of its own thread
+        self._sock_fd: int | None = None
+        self._misc_timer: asyncio.TimerHandle | None = None
+
+    @property
+    def api(self) -> PhilipsAirPlusAPI:
+        """API of the oldest loaded entry, used for the next connection attempt."""
+        return next(iter(self._apis.values()))
+
+    @property
+    def connected(self) -> bool:
+        return self._mqtt_client is not None and self._mqtt_client.is_connected()
+
+    @callback
+    def async_add_entry(self, entry_id: str, api: PhilipsAirPlusAPI) -> None:
+        self._apis[entry_id] = api
+
+    @callback
+    def async_remove_entry(self, entry_id: str) -> bool:
+        """Forget an entry, returns True once no entry uses the hub anymore."""
+        self._apis.pop(entry_id, None)
+        return not self._apis
+
+    @callback
+    def async_start(self) -> None:
+        """Build the client and start the connection loop, once per hub."""
+        if self._reconnect_task is not None:
+            return
+        self._mqtt_client = self._build_client()
+        self._should_reconnect = True
+        self._reconnect_task = asyncio.create_task(self._mqtt_loop())
+
+    async def async_stop(self) -> None:
+        """Stop the connection loop and disconnect."""
+        self._should_reconnect = False
+        # Release any waits in _mqtt_loop, then wait for it to actually stop so
+        # no connection attempt outlives the last config entry
+        self._connected_evt.set()
+        self._disconnected_evt.set()
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reconnect_task
+        if self._connect_future:
+            with contextlib.suppress(Exception):
+                await self._connect_future
+        if self._mqtt_client:
+            self._mqtt_client.disconnect()
+            self._mqtt_client.loop_write()
+
+    @callback
+    def register(self, topic: str, on_message: Callable[[bytes], None]) -> Callable[[], None]:
+        """Route messages on topic to on_message, returns an unregister callback."""
+        self._subscribers[topic] = on_message
+        if self.connected:
+            self._mqtt_client.subscribe(topic)
+
+        @callback
+        def unregister() -> None:
+            self._subscribers.pop(topic, None)
+            if self.connected:
+                self._mqtt_client.unsubscribe(topic)
+
+        return unregister
+
+    def publish(self, topic: str, payload: bytes) -> None:
+        # Commands are fire-and-forget: QoS 0, no retain, and we never call
+        # wait_for_publish() on the returned info
+        self._mqtt_client.publish(topic, payload, qos=0, retain=False)
+
+    def _build_client(self) -> mqtt.Client:
+        """Create the MQTT client once, it is reused across reconnects."""
+        client_id = f"{self.api.user_id}_{os.urandom(4).hex()}"
+        try:
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, transport="websockets")
+        except AttributeError:
+            client = mqtt.Client(client_id=client_id, transport="websockets")
+
+        # Home Assistant's shared SSL context avoids re-reading the CA bundle
+        client.tls_set_context(client_context())
+
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.on_disconnect = self._on_disconnect
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        # paho calls on_log for every protocol frame, only hook it up when debugging
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            client.on_log = self._on_log
+        return client
+
+    async def _mqtt_loop(self):
+        """Main MQTT connection loop, reconnecting the shared client on failure."""
+        self._retry_cap = 5
+        while self._should_reconnect:
+            try:
+                _LOGGER.debug("Starting MQTT connection attempt")
+
+                # Refreshes the token if close to expiry; the signature comes
+                # from cache unless the token changed or the broker rejected it
+                signature = await self.api.get_signature()
+
+                # Only the auth headers change between attempts
+                self._mqtt_client.ws_set_options(headers={
+                    'token-header': self.api.authorization,
+                    'x-amz-customauthorizer-signature': signature,
+                    'x-amz-customauthorizer-name': 'CustomAuthorizer',
+                    'tenant': 'da'
+                })
+
+                self._connected_evt.clear()
+                self._disconnected_evt.clear()
+
+                _LOGGER.info("Connecting to Philips Air+ MQTT...")
+                # The TCP/TLS/websocket handshake blocks, so run it in the executor;
+                # afterwards the socket is non-blocking and served by the event loop
+                # Shielded so teardown can wait for the executor job to finish
+                self._connect_future = self.hass.async_add_executor_job(
+                    self._mqtt_client.connect, MQTT_HOST, MQTT_PORT, MQTT_KEEPALIVE
+                )
+                try:
+                    await asyncio.shield(self._connect_future)
+                except Exception:
+                    # e.g. a WebsocketConnectionError when the upgrade is
+                    # refused, the signature may be what was rejected
+                    self.api.invalidate_signature()
+                    raise
+
+                # Wait for the CONNACK; paho's keepalive handles the connection after that
+                try:
+                    await asyncio.wait_for(self._connected_evt.wait(), MQTT_CONNECT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    _LOGGER.warning("MQTT connection timed out, initiating reconnect")
+                    self.api.invalidate_signature()
+                else:
+                    # Monitor the connection
+                    await self._disconnected_evt.wait()
+                    _LOGGER.warning("MQTT connection lost, initiating reconnect")
+
+            except Exception:
+                _LOGGER.exception("Unexpected error in MQTT loop")
+            finally:
+                # Close this attempt's socket before backing off; flushing the
+                # DISCONNECT makes paho close the socket right away. While
+                # connect() is still running in the executor the client must
+                # not be touched, async_stop waits for it and disconnects
+                if self._connect_future is None or self._connect_future.done():
+                    try:
+                        self._mqtt_client.disconnect()
+                        self._mqtt_client.loop_write()
+                    except Exception:
+                        pass
+
+            if self._should_reconnect:
+                # Full jitter so clients don't reconnect in lockstep after an outage
+                retry_delay = random.uniform(0, self._retry_cap)
+                _LOGGER.info("Retrying MQTT connection in %.1fs...", retry_delay)
+                await asyncio.sleep(retry_delay)
+                self._retry_cap = min(self._retry_cap * 2, 300)
+
+    def _on_log(self, client, userdata, level, buf):
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("MQTT Log: %s", buf)
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        code = getattr(rc, "value", rc)
+        if code == 0:
+            _LOGGER.info("Successfully connected to Philips Air+ MQTT")
+            if self._subscribers:
+                client.subscribe([(topic, 0) for topic in self._subscribers])
+            self._on_connected_cb()
+        else:
+            _LOGGER.error("Failed to connect to Philips Air+ MQTT, reason code: %s", str(rc))
+            # The cached signature may be what the broker rejected
+            self.api.invalidate_signature()
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, rc, properties=None):
+        _LOGGER.warning("Disconnected from Philips Air+ MQTT, reason: %s", str(rc))
+        self._on_disconnected_cb()
+
+    def _on_message(self, client, userdata, msg):
+        if handler := self._subscribers.get(msg.topic):
+            handler(msg.payload)
+
+    @callback
+    def _on_connected_cb(self) -> None:
+        self._retry_cap = 5 # Reset backoff only once we truly connected
+        self._connected_evt.set()
+
+    @callback
+    def _on_disconnected_cb(self) -> None:
+        # Both events latch for the current attempt and are only cleared when
+        # the next one starts, so a connect+drop before _mqtt_loop resumes
+        # is still seen in order
+        self._disconnected_evt.set()
+
+    def _run_on_loop(self, func, *args) -> None:
+        """Run func on the event loop, socket callbacks also fire from the executor during connect."""
+        if threading.get_ident() == self.hass.loop_thread_id:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._run_on_loop(self._async_on_socket_open, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._run_on_loop(self._async_on_socket_close)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._run_on_loop(self._async_on_socket_register_write, sock.fileno())
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._run_on_loop(self._async_on_socket_unregister_write)
+
+    @callback
+    def _async_on_socket_open(self, fileno: int) -> None:
+        # Callbacks from the executor are queued in order, so a previous socket
+        # on a reused descriptor has already been released here
+        self._sock_fd = fileno
+        self._loop.add_reader(fileno, self._async_reader_callback)
+        self._misc_timer = self._loop.call_later(1, self._async_misc_loop)
+
+    @callback
+    def _async_on_socket_close(self) -> None:
+        if self._sock_fd is None:
+            return
+        self._loop.remove_reader(self._sock_fd)
+        self._loop.remove_writer(self._sock_fd)
+        self._sock_fd = None
+        if self._misc_timer:
+            self._misc_timer.cancel()
+            self._misc_timer = None
+
+    @callback
+    def _async_on_socket_register_write(self, fileno: int) -> None:
+        if fileno == self._sock_fd:
+            self._loop.add_writer(fileno, self._mqtt_client.loop_write)
+
+    @callback
+    def _async_on_socket_unregister_write(self) -> None:
+        if self._sock_fd is not None:
+            self._loop.remove_writer(self._sock_fd)
+
+    @callback
+    def _async_reader_callback(self) -> None:
+        self._mqtt_client.loop_read()
+        # TLS may hold decrypted data the selector can't see
+        pending = getattr(self._mqtt_client.socket(), "pending", None)
+        if pending is not None and pending():
+            self._loop.call_soon(self._async_reader_callback)
+
+    @callback
+    def _async_misc_loop(self) -> None:
+        """Handle keepalive pings and timeouts, once a second while connected."""
+        self._misc_timer = None
+        self._mqtt_client.loop_misc()
+        # A keepalive timeout closes the socket from within loop_misc
+        if self._sock_fd is None:
+            return
+        self._misc_timer = self._loop.call_later(1, self._async_misc_loop)
@@ -0,0 +1,15 @@
+"""Shared helpers for the Philips Air+ integration."""
+from __future__ import annotations
+
+from typing import Any
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+    def json_dumps(obj: Any) -> bytes:
+        # Match orjson's compact output
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")